@@ -1,7 +1,44 @@
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
 
+VERBOSE = True
+
+
+def allocate_acb_unsorted(units, target):
+    """
+    Spread the units to sell over the purchase orders as evenly as possible.
+
+    Every purchase order gives up the same number of units (the water level),
+    except the ones holding fewer units than that level, which are emptied.
+    The level is found with a prefix sum over the units sorted in ascending
+    order, so no Python loop over the purchase orders is needed.
+
+    Unlike allocate_acb() in tax_calculator_simulator.py, the units do not need
+    to be sorted: they are sorted here and the allocation is returned in the
+    input order.
+
+    Args:
+        units (ndarray): Units held in each purchase order.
+        target (int or float): Total number of units to sell.
+
+    Returns:
+        ndarray: Units to remove from each purchase order, in the same order
+        as `units`.
+    """
+    n = units.shape[0]
+    units_sorted = np.sort(units)
+    units_cumsum = np.concatenate(([0.0], np.cumsum(units_sorted)[:-1]))
+
+    # Units sold if the level were set at each purchase order
+    capacity = units_sorted * np.arange(n, 0, -1) + units_cumsum
+    k = min(np.searchsorted(capacity, target), n - 1)
+    level = (target - units_cumsum[k]) / (n - k)
+
+    return np.minimum(units, level)
+
+
 # Data provided by the user
 data = {
     "Date": [
@@ -62,8 +99,9 @@ df_purchase = pd.DataFrame(data)
 df_purchase["Date"] = pd.to_datetime(df_purchase["Date"], format="%d/%m/%Y")
 
 df_balance = df_purchase.copy()
-print("Ooriginal Balance:")
-print(df_balance, "\n")
+if VERBOSE:
+    print("Ooriginal Balance:")
+    print(df_balance, "\n")
 
 df_sales = pd.DataFrame(
     {
@@ -75,95 +113,78 @@ df_sales = pd.DataFrame(
 df_sales["Value"] = df_sales["Units"] * df_sales["Price"]
 
 sales_infos = []
-for _, row_s in df_sales.iterrows():
+for row_s in df_sales.itertuples(index=False):
 
     # Select purchases until sale date
-    df_balance_temp = df_balance[
-        df_balance["Date"] <= df_sales["Date"].iloc[-1]
-    ].sort_values("Units")
+    df_balance_temp = df_balance[df_balance["Date"] <= df_sales["Date"].iloc[-1]]
 
     # Check if units can be sold:
-    if row_s["Units"] <= df_balance_temp["Units"].sum():
+    if row_s.Units <= df_balance_temp["Units"].sum():
 
         # Calculate average purchasing price
         average_purchase_price = (
             df_balance_temp["Units"] * df_balance_temp["Price"]
         ).sum() / df_balance_temp["Units"].sum()
-        print(f"Average Purchase Price: {average_purchase_price}")
 
-        sold_value = row_s["Value"]
-        average_purchase_value = row_s["Units"] * average_purchase_price
+        sold_value = row_s.Value
+        average_purchase_value = row_s.Units * average_purchase_price
         profit = round((sold_value - average_purchase_value), 2)
         taxes = 0
         if profit > 0:
             taxes = round(profit * 0.275, 2)
         net_profit = profit - taxes
-        print(
-            (
-                f"Sold {row_s['Units']} units for a value of {sold_value}. "
-                f"The {row_s['Units']} units were purchased at an "
-                f"average price of {round(average_purchase_price, 2)}, "
-                f"which means their average value is "
-                f"{round(average_purchase_value, 2)}"
+        if VERBOSE:
+            print(f"Average Purchase Price: {average_purchase_price}")
+            print(
+                (
+                    f"Sold {row_s.Units} units for a value of {sold_value}. "
+                    f"The {row_s.Units} units were purchased at an "
+                    f"average price of {round(average_purchase_price, 2)}, "
+                    f"which means their average value is "
+                    f"{round(average_purchase_value, 2)}"
+                )
             )
-        )
-        print(
-            f"Gross Profit: {round(profit, 2)} "
-            f"({round(sold_value, 2)} - {round(average_purchase_value, 2)})"
-        )
-        print(f"Taxes: {taxes}\n")
+            print(
+                f"Gross Profit: {round(profit, 2)} "
+                f"({round(sold_value, 2)} - {round(average_purchase_value, 2)})"
+            )
+            print(f"Taxes: {taxes}\n")
         sales_infos.append(
             {
                 "Gross Profit": profit,
-                "Taxes": taxes,
                 "Net Profit": net_profit,
+                "Taxes": taxes,
                 "Average Purchase Price": round(average_purchase_price, 2),
             }
         )
 
         # Update balance
-        tot_units_sold = 0
-        units_to_sell_avg = row_s["Units"] / df_balance_temp.shape[0]
-        k = 1
-        for j, row_b in df_balance_temp.iterrows():
-
-            units_diff = row_b["Units"] - units_to_sell_avg
-            if units_diff < 0:
-                n = df_balance_temp.shape[0] - k
-                units_to_sell_avg += abs(units_diff) / n
-                units_to_sell = row_b["Units"]
-                tot_units_sold += units_to_sell
-            else:
-                units_to_sell = units_to_sell_avg
-                tot_units_sold += units_to_sell
-
-            df_balance.loc[j, "Units"] -= units_to_sell
-
-            # Update counter
-            k += 1
+        idx = df_balance_temp.index.to_numpy()
+        alloc = allocate_acb_unsorted(
+            df_balance_temp["Units"].to_numpy(copy=True), row_s.Units
+        )
+        df_balance.loc[idx, "Units"] = df_balance.loc[idx, "Units"].to_numpy() - alloc
+        tot_units_sold = alloc.sum()
 
         df_balance = df_balance[df_balance["Units"] > 0].reset_index(drop=True)
 
         # Check if sold units match target:
-        if round(row_s["Units"]) == round(tot_units_sold):
-            print("Updated Balance:")
-            print(df_balance)
-        else:
+        if round(row_s.Units) != round(tot_units_sold):
             raise Exception(
                 f"Sold units ({round(tot_units_sold)}) != "
-                f"target ({round(row_s['Units'])})"
+                f"target ({round(row_s.Units)})"
             )
-        print("-----------------------------------------------------")
+        if VERBOSE:
+            print("Updated Balance:")
+            print(df_balance)
+            print("-----------------------------------------------------")
     else:
         raise Exception(
-            f"Too many units to be sold! {row_s['Units']} > "
+            f"Too many units to be sold! {row_s.Units} > "
             f"{df_balance_temp['Units'].sum()}"
         )
 
 # Add sales additional infos
-df_sales["Gross Profit"] = [x["Gross Profit"] for x in sales_infos]
-df_sales["Net Profit"] = [x["Net Profit"] for x in sales_infos]
-df_sales["Taxes"] = [x["Taxes"] for x in sales_infos]
-df_sales["Average Purchase Price"] = [x["Average Purchase Price"] for x in sales_infos]
+df_sales = df_sales.join(pd.DataFrame(sales_infos))
 
 print(df_sales)
@@ -9,6 +9,15 @@ import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
+try:
+    from numba import njit
+
+    HAVE_NUMBA = True
+except ImportError:
+    # Numba is optional: without it the ACB allocation uses the NumPy implementation
+    HAVE_NUMBA = False
+
+
 # %% [markdown]
 # # Parameters
 
@@ -25,15 +34,30 @@ VERBOSE = True
 
 
 # %%
+def calculate_taxes(capital_gains):
+    """
+    Calculate the taxes on one or more capital gains. Only positive capital gains are
+    taxed, so all sales can be processed at once without branching on each of them.
+
+    Args:
+        capital_gains (float or ndarray): The capital gains.
+
+    Returns:
+        ndarray: The taxes based on the capital gains and a predefined TAX_RATE.
+    """
+
+    return np.where(capital_gains > 0, capital_gains * TAX_RATE, 0.0)
+
+
 def tax_calculator_ACB(selling_units, selling_price, average_purchase_price):
     """
-    Calculate the profit and taxes based on selling units, selling price,
-    and average purchase price.
+    Calculate the profit based on selling units, selling price, and average purchase
+    price.
 
     The function computes the total purchase value of the units sold at
-    their average purchase price, calculates the profit by subtracting
-    the purchase value from the selling value, and applies taxes only
-    if the profit is positive.
+    their average purchase price and calculates the profit by subtracting
+    the purchase value from the selling value. Taxes are calculated once
+    for all sales with calculate_taxes().
 
     Args:
         selling_units (int or float): Number of units sold.
@@ -41,221 +65,263 @@ def tax_calculator_ACB(selling_units, selling_price, average_purchase_price):
         average_purchase_price (float): Average purchase price per unit.
 
     Returns:
-        tuple: A tuple containing:
-            - capital_gain (float): The calculated capital gain from the sale.
-            - taxes (float): The calculated taxes based on profit and a
-              predefined TAX_RATE. If no profit, taxes will be 0.
+        float: The calculated capital gain from the sale.
     """
     # Purchase value that the selling units would have if bought at the same price
     average_purchase_value = selling_units * average_purchase_price
 
     # Profit: current selling value - average purchase value
     sold_value = selling_units * selling_price
-    capital_gain = sold_value - average_purchase_value
 
-    # Calculate taxes only if profit is positive
-    taxes = 0
-    if capital_gain > 0:
-        taxes = capital_gain * TAX_RATE
+    return sold_value - average_purchase_value
 
-    return capital_gain, taxes
 
+def calculate_average_purchase_price(units, unit_prices):
+    """
+    Calculate the average purchase price of an asset, weighting the unit price of each
+    purchase order by its units.
 
-def calculate_units_to_remove_from_purchase_order(
-    purchase_order_units, units_to_sell_avg, number_of_purchase_orders, counter_order
-):
+    The weighted sum is computed as a dot product on the NumPy arrays, so no temporary
+    Series is built and no index alignment takes place.
+
+    Args:
+        units (ndarray): The number of units in each purchase order.
+        unit_prices (ndarray): The unit price of each purchase order.
+
+    Returns:
+        float: The average purchase price per unit.
+    """
+
+    return float(units @ unit_prices) / float(units.sum())
+
+
+def _allocate_acb_loop(units_sorted, target):
     """
-    Calculate the number of units to sell and adjust the average units to sell
-    per purchase order based on the difference between available purchase order
-    units and the average units to sell.
+    Calculate the number of units to remove from each purchase order so that
+    the units sold are spread as evenly as possible across the orders.
+
+    Every purchase order gives up the same number of units (the water level),
+    except the orders holding fewer units than the level, which are sold
+    entirely. Going through the orders in ascending order, the level is the
+    units left to sell after emptying the smaller orders, divided by the
+    remaining orders. The first order holding at least that level fixes it.
 
-    If the available units in the current purchase order are less than the
-    average units to sell, the average is adjusted for the remaining purchase
-    orders, and all units from the current order are sold. Otherwise, the
-    average units are sold.
+    This loop is only meant to run compiled with Numba, where the running sum
+    and the level search become a single machine-code loop. As plain Python it
+    is much slower than _allocate_acb_vectorized().
 
     Args:
-        purchase_order_units (int or float): The number of units in the current purchase order.
-        units_to_sell_avg (float): The average number of units to sell from each purchase order.
-        number_of_purchase_orders (int): The total number of purchase orders.
-        counter_order (int): The current purchase order index being processed.
+        units_sorted (ndarray): The number of units in each purchase order,
+            sorted in ascending order.
+        target (int or float): The total number of units to sell.
 
     Returns:
-        tuple: A tuple containing:
-            - units_to_sell (float): The actual number of units to sell from the current order.
-            - units_to_sell_avg (float): The updated average units to sell for future orders.
+        ndarray: The number of units to remove from each purchase order, in the
+        same order as `units_sorted`. The last value is the water level.
     """
 
-    # Calculate the difference between purchase order units and average units to sell
-    units_diff = purchase_order_units - units_to_sell_avg
+    n = units_sorted.shape[0]
+    units_before = 0.0  # Units of the orders emptied so far
+    level = 0.0
 
-    if units_diff < 0:
-        # If not enough units are available, adjust the average units to sell
-        n = number_of_purchase_orders - counter_order  # Remaining purchase orders
-        units_to_sell_avg += abs(units_diff) / n  # Adjust the average
-        units_to_sell = purchase_order_units  # Sell all available units
-    else:
-        # If enough units are available, sell the average amount
-        units_to_sell = units_to_sell_avg
+    for k in range(n):
+        level = (target - units_before) / (n - k)
+        if units_sorted[k] >= level:
+            break
+        units_before += units_sorted[k]
 
-    return units_to_sell, units_to_sell_avg
+    return np.minimum(units_sorted, level)
 
 
-def update_balance(df_balance, df_balance_asset, total_units_to_sell, asset_to_sell):
+def _allocate_acb_vectorized(units_sorted, target):
     """
-    Update the balance of units based on the total units to sell and the temporary balance
-    of purchase orders. This function adjusts the units in the original balance DataFrame
-    and returns the updated balance along with the total number of units sold.
+    Calculate the number of units to remove from each purchase order so that
+    the units sold are spread as evenly as possible across the orders.
+
+    Same allocation as _allocate_acb_loop(), with the level found by a prefix
+    sum: for the k-th smallest order, the units sold with the level set at its
+    size are the units of the k smaller orders plus the level times the
+    remaining (n - k) orders.
 
     Args:
-        df_balance (DataFrame): The original balance DataFrame containing current unit counts.
-        df_balance_temp (DataFrame): The temporary DataFrame of purchase orders to process.
-        total_units_to_sell (int or float): The total number of units to sell from the balance.
+        units_sorted (ndarray): The number of units in each purchase order,
+            sorted in ascending order.
+        target (int or float): The total number of units to sell.
 
     Returns:
-        tuple: A tuple containing:
-            - df_balance (DataFrame): The updated balance DataFrame after processing.
-            - tot_units_sold (int or float): The total number of units sold during the update.
+        ndarray: The number of units to remove from each purchase order, in the
+        same order as `units_sorted`. The last value is the water level.
     """
 
-    # Define parameters for balance update
-    counter_order = 1  # Count how many purchase orders have been processed
-    tot_units_sold = 0  # Keep track of how many units have been removed from balance
-    number_of_purchase_orders = df_balance_asset[
-        df_balance_asset["Asset"] == asset_to_sell
-    ].shape[
-        0
-    ]  # Number of purchase orders
-    units_to_sell_avg = (
-        total_units_to_sell / number_of_purchase_orders
-    )  # Average units to remove from each order
+    n = units_sorted.shape[0]
 
-    # Update balance
-    for j, row_b in df_balance_asset[
-        df_balance_asset["Asset"] == asset_to_sell
-    ].iterrows():
-        # Remove units from purchase orders
-        units_to_sell, units_to_sell_avg = (
-            calculate_units_to_remove_from_purchase_order(
-                purchase_order_units=row_b["Units"],
-                units_to_sell_avg=units_to_sell_avg,
-                number_of_purchase_orders=number_of_purchase_orders,
-                counter_order=counter_order,
-            )
-        )
+    # Units held by the orders smaller than each order
+    units_cumsum = np.concatenate(([0.0], np.cumsum(units_sorted)[:-1]))
+
+    # Units sold if the level is set at each order, and first order reaching target
+    capacity = units_sorted * np.arange(n, 0, -1) + units_cumsum
+    k = min(np.searchsorted(capacity, target), n - 1)
+    level = (target - units_cumsum[k]) / (n - k)
+
+    return np.minimum(units_sorted, level)
+
+
+# Compiled loop with Numba, NumPy prefix sum otherwise
+allocate_acb = njit()(_allocate_acb_loop) if HAVE_NUMBA else _allocate_acb_vectorized
+
+
+def update_balance(units, total_units_to_sell, units_sorted=None):
+    """
+    Update the balance of units based on the total units to sell with the ACB method. The
+    units of the purchase orders are updated in place.
+
+    The units of the purchase orders which still have units, sorted in ascending order, can
+    be passed from a previous update to avoid sorting them again. Selling with the ACB method
+    keeps that order, since every order is left with max(units - level, 0) and emptied orders
+    are the smallest ones, so the units left are returned sorted for the next update.
+
+    Args:
+        units (ndarray): The units of the purchase orders to process, updated in place.
+        total_units_to_sell (int or float): The total number of units to sell from the balance.
+        units_sorted (ndarray, optional): Units of the purchase orders which still have units,
+            sorted in ascending order. Sorted again if missing or not matching the purchase
+            orders.
 
-        # Subtract the units to sell from the balance DataFrame
-        df_balance.loc[j, "Units"] -= units_to_sell
+    Returns:
+        ndarray: Units left in the purchase orders which still have units, sorted in
+        ascending order.
+    """
 
-        # Update the counter for the next order
-        counter_order += 1
+    # Sort units only if they changed since the last update
+    if units_sorted is None or units_sorted.shape[0] != np.count_nonzero(units):
+        units_sorted = np.sort(units[units > 0])
 
-        # Update the total number of units sold
-        tot_units_sold += units_to_sell
+    # Units to remove from each purchase order: none gives up more than the level
+    units_to_sell_sorted = allocate_acb(units_sorted, total_units_to_sell)
+    units -= np.minimum(units, units_to_sell_sorted[-1])
 
-    # Remove from balance orders which no longer have units
-    df_balance = df_balance[df_balance["Units"] > 0].reset_index(drop=True)
+    # Drop orders which no longer have units
+    units_sorted = units_sorted - units_to_sell_sorted
 
-    return df_balance, tot_units_sold
+    return units_sorted[units_sorted > 0]
 
 
-def tax_calculator_XYFO(selling_units, selling_price, df_balance, df_balance_temp):
+def tax_calculator_XYFO(selling_units, selling_price, units, unit_prices, idx):
     """
-    Calculate the capital gain and taxes based on selling units, updating the balance of units.
+    Calculate the capital gain based on selling units, updating the balance of units.
 
-    The function processes the units sold from the current balance, updates the balance DataFrame,
-    and calculates the capital gain and taxes. It iterates through the purchase orders, selling
-    units from each until the required number of units are sold or no more units are available.
+    Units are sold from the purchase orders in the given selling order: the orders whose
+    cumulative units stay below the units to sell are emptied, the next one is partially sold
+    and the remaining ones are left untouched. The units of the purchase orders are updated
+    in place.
 
     Args:
         selling_units (int or float): Number of units to sell.
-        df_balance (DataFrame): The original balance DataFrame containing current unit counts.
-        df_balance_temp (DataFrame): Temporary DataFrame with purchase order details.
+        selling_price (float): Selling price per unit.
+        units (ndarray): The units of the purchase orders, updated in place.
+        unit_prices (ndarray): The unit price of each purchase order.
+        idx (ndarray): The positions of the purchase orders in selling order.
 
     Returns:
-        tuple: A tuple containing:
-            - capital_gain (float): The calculated capital gain from the sale.
-            - taxes (float): The calculated taxes based on capital gain and a predefined TAX_RATE.
-            - df_balance (DataFrame): The updated balance DataFrame after processing.
-            - tot_units_sold (int or float): The total number of units sold.
+        float: The calculated capital gain from the sale.
     """
 
-    # Initialize variables for tracking progress
-    tot_units_sold = 0  # Track how many units have been removed from the balance
-    total_units_to_sell = selling_units  # Total units to sell
-    units_to_sell = total_units_to_sell  # Units left to sell
-    capital_gain = 0  # Initliaze capital gains
-    taxes = 0  # Initliaze taxes
-    flag = False  # Flag to stop the loop when no more units need to be sold
-
-    # Iterate through the temporary balance (purchase orders)
-    for j, row_b in df_balance_temp.iterrows():
-        # Check if the units in the current purchase order are less than or equal to units to sell
-        if row_b["Units"] <= units_to_sell:
-            # Sell all units from this purchase order
-            df_balance.loc[j, "Units"] = 0  # Set units in the balance to zero
-            units_sold = row_b["Units"]  # Number of units sold from this order
-            units_to_sell -= units_sold  # Subtract the sold units from units_to_sell
-            tot_units_sold += units_sold  # Add to total units sold
-        else:
-            # Sell only the required number of units and stop further processing
-            units_sold = units_to_sell
-            df_balance.loc[j, "Units"] = (
-                row_b["Units"] - units_to_sell
-            )  # Update remaining units
-            tot_units_sold += units_sold
-            flag = True  # Set flag to exit the loop since all required units are sold
-
-        # Calculate capital gain for the units sold from this purchase order
-        cg = units_sold * (selling_price - row_b["Unit Price"])
-        capital_gain += cg
+    # Purchase orders in selling order
+    units_ordered = units[idx]
+    unit_prices_ordered = unit_prices[idx]
 
-        if VERBOSE:
-            print(
-                f"Purchased {row_b['Units']} units at {row_b['Unit Price']} and sold them at {selling_price}. Capital gain {round(cg, 2)}"
-            )
+    # Units sold from each purchase order: what is left to sell after the previous
+    # orders have been emptied, capped by the units available in the order
+    units_before = np.cumsum(units_ordered) - units_ordered
+    units_sold = np.clip(selling_units - units_before, 0, units_ordered)
 
-        # Exit the loop once all units are sold
-        if flag:
-            break
+    # Calculate capital gain for the units sold from each purchase order
+    capital_gains = units_sold * (selling_price - unit_prices_ordered)
+    capital_gain = float(capital_gains.sum())
 
-    # Calculate taxes if there's a positive capital gain
-    if capital_gain > 0:
-        taxes = capital_gain * TAX_RATE
+    # Update remaining units in a single assignment
+    units[idx] = units_ordered - units_sold
 
-    return capital_gain, taxes, df_balance, tot_units_sold
+    if VERBOSE:
+        # Log all purchase orders sold from with a single print
+        sold_orders = units_sold > 0
+        print(
+            "\n".join(
+                f"Purchased {purchase_units} units at {unit_price} and sold them at {selling_price}. Capital gain {round(cg, 2)}"
+                for purchase_units, unit_price, cg in zip(
+                    units_ordered[sold_orders],
+                    unit_prices_ordered[sold_orders],
+                    capital_gains[sold_orders],
+                )
+            )
+        )
 
+    return capital_gain
 
-def take_balance_snapshot(df_balance_evolution, df_balance, date):
+
+def build_balance(balances, balances_units, date, asset_dtype, currency_dtype):
     """
-    Capture a snapshot of the current balance and add it to the balance evolution DataFrame.
+    Build the balance DataFrame up to a date from the purchase orders of each asset.
 
-    This function takes the current state of the balance (including asset names, units, and prices),
-    records the specified date, and appends this snapshot to an existing DataFrame that tracks
-    the evolution of balances over time.
+    Only the units of the purchase orders change over time, so they are kept apart from the
+    other columns and joined to them here, when the balance DataFrame is actually needed.
+    Purchase orders which no longer have units are left out. Currencies are stored as the
+    codes of their categories, so the categorical columns are built without casting.
 
     Args:
-        df_balance_evolution (DataFrame): The existing DataFrame tracking historical balance snapshots.
-        df_balance (DataFrame): The current balance DataFrame containing asset details.
-        date (str or datetime): The date to assign to the snapshot.
+        balances (dict): The date, unit price and currency code arrays of the purchase orders
+            of each asset, sorted by date.
+        balances_units (dict): The units left in the purchase orders of each asset.
+        date (datetime64): The date up to which purchase orders are included.
+        asset_dtype (CategoricalDtype): The categories of the assets.
+        currency_dtype (CategoricalDtype): The categories of the currencies.
 
     Returns:
-        DataFrame: The updated DataFrame (`df_balance_evolution`) with the new snapshot added.
+        DataFrame: The balance DataFrame up to the given date.
+    """
+
+    columns = {
+        column: [] for column in ["Date", "Asset", "Units", "Unit Price", "Currency"]
+    }
+    for asset, balance_asset in balances.items():
+        n_orders = np.searchsorted(balance_asset["Date"], date, side="right")
+        units = balances_units[asset][:n_orders]
+        has_units = units > 0
+        columns["Date"].append(balance_asset["Date"][:n_orders][has_units])
+        columns["Asset"].append(
+            np.full(np.count_nonzero(has_units), asset_dtype.categories.get_loc(asset))
+        )
+        columns["Units"].append(units[has_units])
+        columns["Unit Price"].append(balance_asset["Unit Price"][:n_orders][has_units])
+        columns["Currency"].append(balance_asset["Currency"][:n_orders][has_units])
+
+    columns = {column: np.concatenate(arrays) for column, arrays in columns.items()}
+    columns["Asset"] = pd.Categorical.from_codes(columns["Asset"], dtype=asset_dtype)
+    columns["Currency"] = pd.Categorical.from_codes(
+        columns["Currency"], dtype=currency_dtype
+    )
+
+    return pd.DataFrame(columns)
+
+
+def take_balance_snapshot(df_balance, date):
     """
+    Capture a snapshot of the current balance to track the evolution of balances over time.
 
-    # Create a snapshot of the current balance with selected columns
-    df_balance_snapshot = df_balance[
-        ["Asset", "Units", "Unit Price", "Currency"]
-    ].copy()
+    This function takes the current state of the balance (including asset names, units, and prices)
+    and records the specified date. Snapshots are collected in a list and concatenated once after
+    all change events, instead of growing the balance evolution DataFrame at every event.
 
-    # Add the date to the snapshot
-    if not df_balance_snapshot.empty:
-        df_balance_snapshot.loc[:, "Date"] = date
+    Args:
+        df_balance (DataFrame): The current balance DataFrame containing asset details.
+        date (str or datetime): The date to assign to the snapshot.
 
-    # Append the snapshot to the historical balance evolution DataFrame
-    df_balance_evolution = pd.concat([df_balance_evolution, df_balance_snapshot])
+    Returns:
+        DataFrame: The snapshot of the balance at the given date.
+    """
 
-    return df_balance_evolution
+    # Create a snapshot of the current balance with selected columns and add the date
+    return df_balance[["Asset", "Units", "Unit Price", "Currency"]].assign(Date=date)
 
 
 # %% [markdown]
@@ -271,20 +337,23 @@ df_transactions["Date"] = pd.to_datetime(
 )
 df_transactions["Type Orig"] = df_transactions["Type"]
 
-# Airdrops: they are like purchases where acquisition costs are set at zero
-df_transactions.loc[df_transactions["Type"] == "Airdrop", "Unit Price"] = 0
-df_transactions.loc[df_transactions["Type"] == "Airdrop", "Currency"] = CURRENCY
-df_transactions.loc[df_transactions["Type"] == "Airdrop", "Type"] = "Purchase"
-df_transactions
-
-# Staking rewards: they are like purchases where acquisition costs are set at zero
-df_transactions.loc[df_transactions["Type"] == "Staking", "Unit Price"] = 0
-df_transactions.loc[df_transactions["Type"] == "Staking", "Currency"] = CURRENCY
-df_transactions.loc[df_transactions["Type"] == "Staking", "Type"] = "Purchase"
-
+# Airdrops and staking rewards: they are like purchases where acquisition costs are set at zero
 # Mining rewards: they are like purchases but taxed at receipt
-df_transactions.loc[df_transactions["Type"] == "Mining", "Currency"] = CURRENCY
-df_transactions.loc[df_transactions["Type"] == "Mining", "Type"] = "Purchase"
+zero_cost = df_transactions["Type"].isin(["Airdrop", "Staking"])
+df_transactions.loc[zero_cost, "Unit Price"] = 0
+rewards = zero_cost | (df_transactions["Type"] == "Mining")
+df_transactions.loc[rewards, "Currency"] = CURRENCY
+df_transactions.loc[rewards, "Type"] = "Purchase"
+
+# Categorical columns: filters on asset, type and currency compare integer codes
+for column in ["Asset", "Type", "Type Orig"]:
+    df_transactions[column] = df_transactions[column].astype("category")
+
+# Swapped assets are valued in CURRENCY, which may not appear in the transactions
+currencies = set(df_transactions["Currency"].dropna()) | {CURRENCY}
+df_transactions["Currency"] = df_transactions["Currency"].astype(
+    pd.CategoricalDtype(sorted(currencies))
+)
 
 df_transactions
 
@@ -322,147 +391,173 @@ df_sales
 # Step 2 Check if current transaction is swap or sell
 # step 2 Select transactions from balance (copy of original purchase) less then date from step 1
 
-# Initiate
-df_balance = df_purchase.copy()
-sales_taxes = []
+# Initiate: capital gain and average unit price of each sale, taxed after the loop
+capital_gains = []
+average_purchase_prices = []
+
+# Split balance by asset into arrays, each one sorted by purchase date. Only the units
+# change over time: they are kept in a separate float array, updated in place (whole
+# units are read as integers, which could not hold the fractions left by a sale)
+balances = {}
+balances_units = {}
+for asset, df_balance_asset in df_purchase.groupby("Asset", observed=True):
+    df_balance_asset = df_balance_asset.sort_values("Date")
+    balances[asset] = {
+        "Date": df_balance_asset["Date"].to_numpy(copy=True),
+        "Unit Price": df_balance_asset["Unit Price"].to_numpy(dtype=float, copy=True),
+        "Currency": df_balance_asset["Currency"].cat.codes.to_numpy(copy=True),
+    }
+    balances_units[asset] = df_balance_asset["Units"].to_numpy(dtype=float, copy=True)
+
+# Categories of the balance columns stored as codes
+asset_dtype = df_purchase["Asset"].dtype
+currency_dtype = df_purchase["Currency"].dtype
+
+# Units of each asset sorted in ascending order, dropped when they need sorting again
+balances_units_sorted = {}
 
 # Initate balance evolution
 first_transaction_date = df_transactions[df_transactions["Type"] != "Purchase"].iloc[0][
     "Date"
 ]
-df_balance_snapshot = df_balance[df_balance["Date"] < first_transaction_date][
+df_balance_snapshot = df_purchase[df_purchase["Date"] < first_transaction_date][
     ["Date", "Asset", "Units", "Unit Price", "Currency"]
 ].copy()
 df_balance_snapshot.loc[:, "Date"] = df_balance_snapshot.iloc[-1]["Date"]
-df_balance_evolution = df_balance_snapshot
+df_balance_snapshots = [df_balance_snapshot]
 
 # Select transactions which are not a Purchase
 change_events = df_transactions[df_transactions["Type"] != "Purchase"][
     ["Date", "Type"]
 ].drop_duplicates()
 
+# Transactions which are not a Purchase, by date and type of the change event
+events_by_date = {
+    date_type: df_event
+    for date_type, df_event in df_transactions[
+        df_transactions["Type"] != "Purchase"
+    ].groupby(["Date", "Type"], sort=False, observed=True)
+}
+
 if VERBOSE:
     print("######################################################################")
     print(f"\t\t\t\t{METHOD}")
     print("######################################################################\n")
     print("Original Balance:")
-    print(df_balance[df_balance["Date"] < first_transaction_date])
+    print(df_purchase[df_purchase["Date"] < first_transaction_date])
     print("\n----------------------------------------------------------------------\n")
 
 
 # Loop through all events which modify the balance
-for _, change in change_events.iterrows():
+for change in change_events.itertuples(index=False):
+
+    # Date of the change event, to be compared with the balance dates
+    change_date = change.Date.to_datetime64()
 
     # Update balance
-    if change["Type"] == "Swap":
+    if change.Type == "Swap":
 
         # Select swap
-        swap = df_transactions[
-            (df_transactions["Type"] == "Swap")
-            & (df_transactions["Date"] == change["Date"])
-        ]
+        swap = events_by_date[(change.Date, "Swap")]
 
         # Split between asset in and out
         asset_out = swap.iloc[[0]]
         asset_in = swap.iloc[[1]]
 
         # Select from balance all transactions for swapped asset up to change event
-        df_balance_asset = df_balance[
-            (df_balance["Asset"] == asset_out["Asset"].iloc[0])
-            & (df_balance["Date"] < change["Date"])
-        ]
+        balance_asset = balances[asset_out["Asset"].iloc[0]]
+        n_previous_orders = np.searchsorted(balance_asset["Date"], change_date)
+        units = balances_units[asset_out["Asset"].iloc[0]][:n_previous_orders]
+        unit_prices = balance_asset["Unit Price"][:n_previous_orders]
 
         # Calculate average purchase price of new asset
         average_purchase_price = (
-            (
-                (df_balance_asset["Units"] * df_balance_asset["Unit Price"]).sum()
-                / df_balance_asset["Units"].sum()
-            )
+            calculate_average_purchase_price(units, unit_prices)
             * asset_out["Units"].iloc[0]
             / asset_in["Units"].iloc[0]
         )
 
-        # Update balance swapped asset (out)
-        df_balance_asset_updated, _ = update_balance(
-            df_balance_asset,
-            df_balance_asset,
+        # Update balance swapped asset (out) in place
+        balances_units_sorted[asset_out["Asset"].iloc[0]] = update_balance(
+            units,
             asset_out["Units"].iloc[0],
-            asset_out["Asset"].iloc[0],
-        )
-        # Include swaped asset (in)
-        asset_in.loc[:, "Unit Price"] = average_purchase_price
-        asset_in.loc[:, "Currency"] = (
-            "EUR"  # This could be further improved for other currencies
+            balances_units_sorted.get(asset_out["Asset"].iloc[0]),
         )
-        df_balance_asset_updated = pd.concat(
-            [df_balance_asset_updated, asset_in]
-        ).reset_index(drop=True)
-
-        # Update all balance up to swap event
-        df_balance_other_previous_assets = df_balance[
-            (df_balance["Asset"] != asset_out["Asset"].iloc[0])
-            & (df_balance["Date"] < change["Date"])
-        ]
-        df_balance = (
-            pd.concat(
-                [
-                    df_balance_asset_updated,
-                    df_balance_other_previous_assets,
-                    df_balance[(df_balance["Date"] > change["Date"])],
-                ]
+
+        # Include swaped asset (in), inserted after the orders up to the swap, keeping the
+        # balance sorted by date
+        purchase_order_in = {
+            "Date": change_date,
+            "Unit Price": average_purchase_price,
+            "Currency": currency_dtype.categories.get_loc(
+                CURRENCY  # This could be further improved for other currencies
+            ),
+        }
+        balance_asset_in = balances.get(asset_in["Asset"].iloc[0])
+        if balance_asset_in is None:
+            balances[asset_in["Asset"].iloc[0]] = {
+                column: np.array([value]) for column, value in purchase_order_in.items()
+            }
+            balances_units[asset_in["Asset"].iloc[0]] = asset_in["Units"].to_numpy(
+                dtype=float, copy=True
             )
-            .sort_values(by="Date")
-            .reset_index(drop=True)
-        )
+        else:
+            position = np.searchsorted(
+                balance_asset_in["Date"], change_date, side="right"
+            )
+            for column, value in purchase_order_in.items():
+                balance_asset_in[column] = np.insert(
+                    balance_asset_in[column], position, value
+                )
+            balances_units[asset_in["Asset"].iloc[0]] = np.insert(
+                balances_units[asset_in["Asset"].iloc[0]],
+                position,
+                asset_in["Units"].iloc[0],
+            )
+        balances_units_sorted.pop(asset_in["Asset"].iloc[0], None)
 
         if VERBOSE:
             print(
                 f"Swapped {asset_out['Units'].iloc[0]} {asset_out['Asset'].iloc[0]} for {asset_in['Units'].iloc[0]} {asset_in['Asset'].iloc[0]}."
             )
             print(
-                f"Average Unit Price: {round(average_purchase_price, 2)} {asset_in['Currency'].iloc[0]}.\n"
+                f"Average Unit Price: {round(average_purchase_price, 2)} {CURRENCY}.\n"
             )
 
-    elif change["Type"] == "Sell":
+    elif change.Type == "Sell":
 
         # Select sell
-        sell = df_transactions[
-            (df_transactions["Type"] == "Sell")
-            & (df_transactions["Date"] == change["Date"])
-        ]
+        sell = events_by_date[(change.Date, "Sell")]
 
         # Select from balance all transactions for sold asset up to change event
-        df_balance_asset = df_balance[
-            (df_balance["Asset"] == sell["Asset"].iloc[0])
-            & (df_balance["Date"] < change["Date"])
-        ]
+        balance_asset = balances[sell["Asset"].iloc[0]]
+        n_previous_orders = np.searchsorted(balance_asset["Date"], change_date)
+        units = balances_units[sell["Asset"].iloc[0]][:n_previous_orders]
+        unit_prices = balance_asset["Unit Price"][:n_previous_orders]
+        units_total = units.sum()
 
         # Check if units can be sold:
-        if sell["Units"].iloc[0] <= df_balance_asset["Units"].sum():
+        if sell["Units"].iloc[0] <= units_total:
 
             if METHOD == "ACB":
 
-                # Sort filtered balance by value
-                df_balance_asset = df_balance_asset.sort_values("Units")
-
                 # Calculate average purchasing price
-                average_purchase_price = (
-                    df_balance_asset["Units"] * df_balance_asset["Unit Price"]
-                ).sum() / df_balance_asset["Units"].sum()
+                average_purchase_price = calculate_average_purchase_price(
+                    units, unit_prices
+                )
 
-                # Calculate capital gain and taxes
-                capital_gain, taxes = tax_calculator_ACB(
+                # Calculate capital gain
+                capital_gain = tax_calculator_ACB(
                     selling_units=sell["Units"].iloc[0],
                     selling_price=sell["Unit Price"].iloc[0],
                     average_purchase_price=average_purchase_price,
                 )
 
-                # Update balance
-                df_balance_asset_updated, tot_units_sold = update_balance(
-                    df_balance_asset,
-                    df_balance_asset,
+                # Update balance in place
+                balances_units_sorted[sell["Asset"].iloc[0]] = update_balance(
+                    units,
                     sell["Units"].iloc[0],
-                    sell["Asset"].iloc[0],
+                    balances_units_sorted.get(sell["Asset"].iloc[0]),
                 )
 
                 if VERBOSE:
@@ -475,116 +570,86 @@ for _, change in change_events.iterrows():
                     print(
                         f"Capital Gain: {round(capital_gain, 2)} ({round(sell['Unit Price'].iloc[0] * sell['Units'].iloc[0], 2)} - {round(sell['Units'].iloc[0] * average_purchase_price, 2)})."
                     )
-                    print(f"Taxes: {taxes}.\n")
+                    print(f"Taxes: {calculate_taxes(capital_gain)}.\n")
 
             elif METHOD in ["FIFO", "LIFO", "HIFO"]:
 
-                # Select right model
+                # Select right model (balance is already sorted by date)
                 if METHOD == "FIFO":
-                    # Sort filtered balance by date
-                    df_balance_asset = df_balance_asset.sort_values("Date")
+                    idx = np.arange(n_previous_orders)
                 elif METHOD == "LIFO":
                     # Sort filtered balance by date in descending order
-                    df_balance_asset = df_balance_asset.sort_values(
-                        "Date", ascending=False
-                    )
+                    idx = np.arange(n_previous_orders)[::-1]
                 elif METHOD == "HIFO":
                     # Sort filtered balance by value in descending order
-                    df_balance_asset = df_balance_asset.sort_values(
-                        "Unit Price", ascending=False
-                    )
+                    idx = np.argsort(-unit_prices, kind="stable")
 
-                # Calculate capital gain, taxes and update balance
-                capital_gain, taxes, df_balance_asset_updated, tot_units_sold = (
-                    tax_calculator_XYFO(
-                        selling_units=sell["Units"].iloc[0],
-                        selling_price=sell["Unit Price"].iloc[0],
-                        df_balance=df_balance_asset,
-                        df_balance_temp=df_balance_asset,
-                    )
+                # Calculate capital gain and update balance in place
+                capital_gain = tax_calculator_XYFO(
+                    selling_units=sell["Units"].iloc[0],
+                    selling_price=sell["Unit Price"].iloc[0],
+                    units=units,
+                    unit_prices=unit_prices,
+                    idx=idx,
                 )
-
-                # Remove from balance orders which no longer have units
-                df_balance_asset_updated = df_balance_asset_updated[
-                    df_balance_asset_updated["Units"] > 0
-                ].reset_index(drop=True)
+                balances_units_sorted.pop(sell["Asset"].iloc[0], None)
 
                 if VERBOSE:
                     print(
                         f"\nSold {sell['Units'].iloc[0]} units for a value of {round(sell['Units'].iloc[0] * sell['Unit Price'].iloc[0], 2)}."
                     )
                     print(f"Capital Gain: {round(capital_gain, 2)}.")
-                    print(f"Taxes: {taxes}.\n")
+                    print(f"Taxes: {calculate_taxes(capital_gain)}.\n")
 
             else:
 
                 raise Exception(f"Method not implemented: {METHOD}")
 
-            # Store profit/taxes infos in sales dataframe
-            sales_taxes.append(
-                {
-                    "Capital Gain": capital_gain,
-                    "Taxes": taxes,
-                    "Net Profit": capital_gain - taxes,
-                    "Average Unit Price": round(average_purchase_price, 2),
-                }
-            )
-
-            # Update all balance up to sell event
-            df_balance_other_previous_assets = df_balance[
-                (df_balance["Asset"] != sell["Asset"].iloc[0])
-                & (df_balance["Date"] < change["Date"])
-            ]
-            df_balance = (
-                pd.concat(
-                    [
-                        df_balance_asset_updated,
-                        df_balance_other_previous_assets,
-                        df_balance[(df_balance["Date"] > change["Date"])],
-                    ]
-                )
-                .sort_values(by="Date")
-                .reset_index(drop=True)
-            )
+            # Store profit infos for the sales dataframe
+            capital_gains.append(capital_gain)
+            average_purchase_prices.append(round(average_purchase_price, 2))
 
         else:
             raise Exception(
-                f"Too many units to be sold! {sell['Units']} > {df_balance_asset['Units'].sum()}"
+                f"Too many units to be sold! {sell['Units']} > {units_total}"
             )
 
     # Collect balances snapshots to track its evolution
-    df_balance_evolution = take_balance_snapshot(
-        df_balance_evolution,
-        df_balance[df_balance["Date"] <= change["Date"]],
-        change["Date"],
+    df_balance = build_balance(
+        balances, balances_units, change_date, asset_dtype, currency_dtype
     )
+    df_balance_snapshots.append(take_balance_snapshot(df_balance, change.Date))
 
     if VERBOSE:
         print("Updated Balance:")
-        print(df_balance[df_balance["Date"] <= change["Date"]])
+        print(df_balance)
         print(
             "\n----------------------------------------------------------------------\n"
         )
 
-# Add sales additional infos
-df_sales_tax = df_sales.join(pd.DataFrame(sales_taxes))
-
-# Add mining taxes at recepit
-mining_taxes = []
-for _, mine in df_transactions[df_transactions["Type Orig"] == "Mining"].iterrows():
-    capita_gain = mine["Unit Price"]
-    tax = capita_gain * TAX_RATE
-    net_profit = capita_gain - tax
-    average_unit_price = mine["Unit Price"]
-    mining_taxes.append(
+# Concatenate all balances snapshots
+df_balance_evolution = pd.concat(df_balance_snapshots, ignore_index=True)
+
+# Add sales additional infos, with the taxes of all sales calculated at once
+capital_gains = np.array(capital_gains, dtype=float)
+taxes = calculate_taxes(capital_gains)
+df_sales_tax = df_sales.join(
+    pd.DataFrame(
         {
-            "Capital Gain": capita_gain,
-            "Taxes": tax,
-            "Net Profit": net_profit,
-            "Average Unit Price": average_unit_price,
+            "Capital Gain": capital_gains,
+            "Taxes": taxes,
+            "Net Profit": capital_gains - taxes,
+            "Average Unit Price": average_purchase_prices,
         }
     )
-df_mining_tax = df_mining.join(pd.DataFrame(mining_taxes))
+)
+
+# Add mining taxes at recepit: the whole unit price is taxed as capital gain
+df_mining_tax = df_mining.copy()
+df_mining_tax["Capital Gain"] = df_mining_tax["Unit Price"]
+df_mining_tax["Taxes"] = df_mining_tax["Capital Gain"] * TAX_RATE
+df_mining_tax["Net Profit"] = df_mining_tax["Capital Gain"] - df_mining_tax["Taxes"]
+df_mining_tax["Average Unit Price"] = df_mining_tax["Unit Price"]
 
 # Concatenate all taxes dataframes
 df_tax = (